@@ -3,3 +3,15 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Build the fuel service (CSV parse, coordinate assignment, spatial
+        # indexes) at worker boot so the first request doesn't pay for it.
+        import numpy as np
+        from .fuel_data_service import get_fuel_service, _nearest_route_sample
+        get_fuel_service()
+        # Invoke the jitted distance kernel once with a dummy input so the
+        # numba compile (seconds on a cold __pycache__) also happens at
+        # boot rather than on the first request.
+        zeros = np.zeros(1, dtype=np.float64)
+        _nearest_route_sample(zeros, zeros, zeros, zeros, 1.0, 1.0)
@@ -1,14 +1,18 @@
 import os
+from bisect import bisect_left, bisect_right
+import numpy as np
+import polyline
 import requests
-from geopy.distance import geodesic
-from typing import List, Tuple, Dict
-from .fuel_data_service import get_fuel_service
+from requests.adapters import HTTPAdapter
+from typing import List, Optional, Tuple, Dict
+from .fuel_data_service import get_fuel_service, get_cached_geocode, store_cached_geocode
 
 class RouteService:
     """Service to calculate routes and optimal fuel stops."""
     
     # Using OpenRouteService (free API - 2000 requests/day)
     ORS_BASE_URL = "https://api.openrouteservice.org/v2"
+    ORS_GEOCODE_URL = "https://api.openrouteservice.org/geocode/search"
     
     # Vehicle parameters
     VEHICLE_RANGE_MILES = 500
@@ -21,13 +25,47 @@ class RouteService:
         if not self.api_key:
             raise ValueError("ORS_API_KEY environment variable is not set. Get a free key at https://openrouteservice.org/dev/#/signup")
         self.fuel_service = get_fuel_service()
-    
+        # Persistent session so repeated ORS calls reuse one TCP/TLS
+        # connection instead of handshaking every request.
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=20))
+
     def geocode_location(self, location: str) -> Tuple[float, float]:
-        """Convert location string to coordinates."""
-        coords = self.fuel_service.geocode_location(f"{location}, USA")
+        """Convert location string to coordinates.
+
+        Prefers ORS's geocoder on the already-open session (no extra
+        rate limit on top of the route call); falls back to Nominatim.
+        Results share the persistent geocode cache.
+        """
+        query = f"{location}, USA"
+        coords = get_cached_geocode(query)
+        if coords is None:
+            coords = self._geocode_ors(query)
+            if coords:
+                store_cached_geocode(query, coords)
+            else:
+                coords = self.fuel_service.geocode_location(query)
         if not coords:
             raise ValueError(f"Could not geocode location: {location}")
         return coords
+
+    def _geocode_ors(self, query: str) -> Optional[Tuple[float, float]]:
+        """Geocode via ORS's Pelias endpoint; returns None on any failure."""
+        try:
+            response = self._session.get(
+                self.ORS_GEOCODE_URL,
+                params={'text': query, 'boundary.country': 'US', 'size': 1},
+                headers={'Authorization': self.api_key},
+                timeout=10,
+            )
+            response.raise_for_status()
+            features = response.json().get('features')
+            if features:
+                lon, lat = features[0]['geometry']['coordinates']
+                return (lat, lon)
+        except Exception as e:
+            print(f"ORS geocoding error for {query}: {e}")
+        return None
     
     def get_route(self, start: str, end: str) -> Dict:
         """
@@ -54,7 +92,7 @@ class RouteService:
             'coordinates': [start_lonlat, end_lonlat],
             'geometry_simplify': True,
         }
-        response = requests.post(url, json=body, headers=headers, timeout=10)
+        response = self._session.post(url, json=body, headers=headers, timeout=10)
         response.raise_for_status()
         
         data = response.json()
@@ -84,7 +122,7 @@ class RouteService:
         # Get the route (1 API call to OpenRouteService)
         route_data = self.get_route(start, end)
         
-        # Convert route coordinates from [lon, lat] to (lat, lon) for geopy
+        # Convert route coordinates from [lon, lat] to (lat, lon)
         route_coords = [(lat_lon[1], lat_lon[0]) for lat_lon in route_data['coordinates']]
         
         # Calculate total distance in miles
@@ -119,7 +157,6 @@ class RouteService:
                 'distance_miles': round(total_distance_miles, 2),
                 'distance_km': round(route_data['distance'] / 1000, 2),
                 'duration_hours': round(route_data['duration'] / 3600, 2),
-                'coordinates': route_coords,
                 'encoded_polyline': self._encode_polyline(route_coords)
             },
             'fuel_stops': fuel_stops,
@@ -145,37 +182,35 @@ class RouteService:
         if not nearby_stations:
             return []
 
-        max_index = max(s['route_index'] for s in nearby_stations) or 1
         for s in nearby_stations:
             s['approx_mile'] = (s['route_index'] / max(len(route_coords) - 1, 1)) * total_distance_miles
 
+        # Sort once by mile marker; each iteration then locates its eligible
+        # window with bisect and takes the cheapest via an argmin slice,
+        # instead of re-filtering and re-sorting the full candidate list.
+        by_mile = sorted(nearby_stations, key=lambda s: s['approx_mile'])
+        miles = np.array([s['approx_mile'] for s in by_mile])
+        prices = np.array([s['price'] for s in by_mile])
+
         fuel_stops = []
         current_mile = 0.0
         remaining_range = self.VEHICLE_RANGE_MILES
-        used_ids = set()
 
         while current_mile + remaining_range < total_distance_miles:
             need_stop_before = current_mile + remaining_range
             search_start = current_mile + remaining_range * 0.4
 
-            candidates = [
-                s for s in nearby_stations
-                if s['id'] not in used_ids
-                and search_start <= s['approx_mile'] <= need_stop_before
-            ]
-
-            if not candidates:
-                candidates = [
-                    s for s in nearby_stations
-                    if s['id'] not in used_ids
-                    and s['approx_mile'] > current_mile
-                    and s['approx_mile'] <= need_stop_before
-                ]
-            if not candidates:
+            lo = bisect_left(miles, search_start)
+            hi = bisect_right(miles, need_stop_before)
+
+            if lo >= hi:
+                # Nothing in the preferred window; fall back to anything
+                # strictly ahead of the current position but still in range.
+                lo = bisect_right(miles, current_mile)
+            if lo >= hi:
                 break
 
-            candidates.sort(key=lambda x: x['price'])
-            best = candidates[0]
+            best = by_mile[lo + int(prices[lo:hi].argmin())]
 
             gallons_to_buy = self.VEHICLE_RANGE_MILES / self.MPG
 
@@ -191,35 +226,27 @@ class RouteService:
                 'distance_from_start_miles': round(best['approx_mile'], 2),
             })
 
-            used_ids.add(best['id'])
             current_mile = best['approx_mile']
             remaining_range = self.VEHICLE_RANGE_MILES
 
         return fuel_stops
     
     @staticmethod
-    def _decode_polyline(encoded: str) -> List[List[float]]:
-        """Decode a Google-encoded polyline string into a list of [lon, lat] pairs."""
-        coords = []
-        i, lat, lng = 0, 0, 0
-        while i < len(encoded):
-            for field in range(2):
-                shift, result = 0, 0
-                while True:
-                    b = ord(encoded[i]) - 63
-                    i += 1
-                    result |= (b & 0x1F) << shift
-                    shift += 5
-                    if b < 0x20:
-                        break
-                delta = ~(result >> 1) if (result & 1) else (result >> 1)
-                if field == 0:
-                    lat += delta
-                else:
-                    lng += delta
-            coords.append([lng / 1e5, lat / 1e5])
-        return coords
+    def _decode_polyline(encoded: str) -> List[Tuple[float, float]]:
+        """Decode a Google-encoded polyline string into a list of (lon, lat) pairs."""
+        return polyline.decode(encoded, geojson=True)
 
     def _encode_polyline(self, coordinates: List[Tuple[float, float]]) -> str:
-        """Simple polyline encoding for map display."""
-        return ','.join([f"{lat},{lon}" for lat, lon in coordinates[::10]])
+        """Google-encode the route geometry for map display; ~5x smaller
+        than serializing every vertex as decimal floats."""
+        return polyline.encode(coordinates)
+
+
+_route_service_instance = None
+
+def get_route_service():
+    """Get or create the global route service instance."""
+    global _route_service_instance
+    if _route_service_instance is None:
+        _route_service_instance = RouteService()
+    return _route_service_instance
@@ -1,9 +1,16 @@
-from django.http import JsonResponse
+from django.http import HttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render
-import json
-from .route_service import RouteService
+import orjson
+from .route_service import get_route_service
+
+
+def _json_response(data, status=200):
+    """JSON response serialized with orjson (2-5x faster than stdlib json,
+    which matters for the large nested route payload)."""
+    return HttpResponse(orjson.dumps(data), status=status,
+                        content_type='application/json')
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -24,30 +31,30 @@ def calculate_route(request):
     }
     """
     try:
-        data = json.loads(request.body)
+        data = orjson.loads(request.body)
         start = data.get('start', '').strip()
         end = data.get('end', '').strip()
         
         if not start or not end:
-            return JsonResponse({
+            return _json_response({
                 'error': 'Both start and end locations are required'
             }, status=400)
         
         # Calculate route and fuel stops
-        route_service = RouteService()
+        route_service = get_route_service()
         result = route_service.calculate_optimal_fuel_stops(start, end)
         
         if 'error' in result:
-            return JsonResponse(result, status=404)
+            return _json_response(result, status=404)
         
-        return JsonResponse(result)
+        return _json_response(result)
         
     except ValueError as e:
-        return JsonResponse({
+        return _json_response({
             'error': str(e)
         }, status=400)
     except Exception as e:
-        return JsonResponse({
+        return _json_response({
             'error': f'Internal server error: {str(e)}'
         }, status=500)
 
@@ -59,7 +66,7 @@ def index(request):
 @require_http_methods(["GET"])
 def health_check(request):
     """Health check endpoint."""
-    return JsonResponse({
+    return _json_response({
         'status': 'ok',
         'service': 'Fuel Route Optimizer API'
     })